@@ -27,6 +27,9 @@ setup(name='transmogrify.filesystem',
           'setuptools',
           'collective.transmogrifier',
       ],
+      extras_require={
+          'streaming': ['scandir'],
+      },
       entry_points="""
       # -*- Entry points: -*-
       [z3c.autoinclude.plugin]
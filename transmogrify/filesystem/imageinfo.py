@@ -0,0 +1,85 @@
+import struct
+
+# Other mimetypes in use for the formats detected, e.g. by the mimetypes
+# module on Python 2 for .bmp files
+MIMETYPE_ALIASES = {'image/bmp': ['image/x-ms-bmp', 'image/x-bmp'],
+                    'image/jpeg': ['image/pjpeg'],
+                    'image/png': ['image/x-png']}
+
+# JPEG start-of-frame markers, which carry the image dimensions
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+
+# JPEG markers which stand alone, without a length field
+JPEG_STANDALONE_MARKERS = set([0x01, 0xD8] + range(0xD0, 0xD8))
+
+
+def getImageInfo(data, mimeType=None):
+    """Return ``(mimetype, width, height)`` for the image in ``data``, parsed
+    from the image header alone, or None if the format is not recognised.
+    If ``mimeType`` is another name for the format found, it is returned
+    as is.
+
+    GIF, PNG, BMP and JPEG images are supported.
+    """
+
+    info = parseImageHeader(data)
+    if info is not None and mimeType in MIMETYPE_ALIASES.get(info[0], ()):
+        info = (mimeType,) + info[1:]
+    return info
+
+
+def parseImageHeader(data):
+    """Return ``(mimetype, width, height)`` for the image in ``data``, or
+    None if the format is not recognised.
+    """
+
+    if data[:6] in ('GIF87a', 'GIF89a') and len(data) >= 10:
+        width, height = struct.unpack('<HH', data[6:10])
+        return 'image/gif', width, height
+
+    if data[:8] == '\x89PNG\r\n\x1a\n' and data[12:16] == 'IHDR' \
+       and len(data) >= 24:
+        width, height = struct.unpack('>II', data[16:24])
+        return 'image/png', width, height
+
+    if data[:2] == 'BM' and len(data) >= 26:
+        headerSize, = struct.unpack('<I', data[14:18])
+        if headerSize == 12:
+            width, height = struct.unpack('<HH', data[18:22])
+        else:
+            width, height = struct.unpack('<ii', data[18:26])
+        return 'image/bmp', width, abs(height)
+
+    if data[:2] == '\xff\xd8':
+        return getJPEGInfo(data)
+
+    return None
+
+
+def getJPEGInfo(data):
+    """Find the dimensions of a JPEG image in its start-of-frame segment,
+    skipping over the segments before it.
+    """
+
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != '\xff':
+            return None
+        marker = ord(data[pos + 1])
+        if marker == 0xFF:
+            # Fill byte
+            pos += 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            pos += 2
+            continue
+
+        length, = struct.unpack('>H', data[pos + 2:pos + 4])
+        if marker in JPEG_SOF_MARKERS:
+            if pos + 9 > len(data):
+                return None
+            height, width = struct.unpack('>HH', data[pos + 5:pos + 9])
+            return 'image/jpeg', width, height
+        pos += 2 + length
+
+    return None
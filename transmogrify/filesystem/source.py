@@ -1,16 +1,57 @@
 import os.path
 import csv
+import logging
 import mimetypes
+import gzip
+import bz2
+import heapq
+import multiprocessing
+from collections import deque
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
 
 from zope.interface import implements, classProvides
 
 from collective.transmogrifier.interfaces import ISectionBlueprint
 from collective.transmogrifier.interfaces import ISection
 
-from collective.transmogrifier.utils import resolvePackageReferenceOrFile
-from collective.transmogrifier.utils import Matcher
+from transmogrify.filesystem.imageinfo import getImageInfo
+from transmogrify.filesystem.text import prepareText
+from transmogrify.filesystem.utils import Spool
+from transmogrify.filesystem.utils import ThreadPool
+from transmogrify.filesystem.utils import prefetch
+from transmogrify.filesystem.utils import scandirectory
+from transmogrify.filesystem.utils import unique
 
-from OFS.Image import File
+# File-like classes to read compressed files with, by compression suffix
+DECOMPRESSORS = {'.gz': gzip.GzipFile,
+                 '.bz2': bz2.BZ2File}
+if lzma is not None:
+    DECOMPRESSORS['.xz'] = lzma.LZMAFile
+
+# Which compressed copy of a file to use if there are several
+COMPRESSION_PREFERENCE = ['.gz', '.bz2', '.xz']
+
+logger = logging.getLogger('transmogrify.filesystem')
+
+# Portal types whose file contents go into their 'text' field
+TEXT_TYPES = ['News Item', 'Document', 'Event']
+
+
+def wrapFile(filename, data, mimeType):
+    """Wrap file data into an OFS File. OFS pulls in a large part of Zope,
+    so it is only imported once it is needed.
+    """
+    from OFS.Image import File
+    fileData = File(filename, filename, data, mimeType)
+    fileData.filename = filename
+    return fileData
 
 
 class FilesystemSource(object):
@@ -22,12 +63,24 @@ class FilesystemSource(object):
     classProvides(ISectionBlueprint)
 
     def __init__(self, transmogrifier, name, options, previous):
+        # Imported here rather than at module level, since these utilities
+        # depend on the Zope page template machinery
+        from collective.transmogrifier.utils import \
+            resolvePackageReferenceOrFile
+        from collective.transmogrifier.utils import Matcher
+
         self.transmogrifier = transmogrifier
         self.name = name
         self.options = options
         self.previous = previous
 
-        self.directory = resolvePackageReferenceOrFile(options['directory'])
+        self.directories = [resolvePackageReferenceOrFile(d.strip())
+                            for d in options['directory'].splitlines()
+                            if d.strip()]
+        if not self.directories:
+            raise ValueError("No directory given.")
+        # The first source directory, for code which expects a single one
+        self.directory = self.directories[0]
         self.metadata = None
         self.delimiter = None
         self.strict = False
@@ -55,6 +108,38 @@ class FilesystemSource(object):
         ignored = options.get('ignored') or ''
         self.ignored = Matcher(*ignored.splitlines())
 
+        self.concurrency = int(options.get('concurrency', '1'))
+        self.statPool = None
+        self.listPool = None
+
+        self.streaming = options.get('streaming', 'false').lower() == 'true'
+        self.sort = options.get('sort', 'true').lower() == 'true'
+        self.spoolSize = int(options.get('spool-size', '100000'))
+
+        if len(self.directories) > 1 and not self.sort:
+            raise ValueError("Multiple directories can only be merged when "
+                             "sorting is on.")
+
+        self.traversal = options.get('traversal', 'walk').lower()
+        if self.traversal not in ('walk', 'depth-first'):
+            raise ValueError("Unknown traversal: %s" % self.traversal)
+
+        self.decompress = options.get('decompress', 'false').lower() == 'true'
+        self.imageInfo = options.get('image-info', 'false').lower() == 'true'
+
+        self.prepareText = options.get('prepare-text',
+                                       'false').lower() == 'true'
+        self.textProcesses = int(options.get('text-processes', '1'))
+        self.fallbackCharset = options.get('fallback-charset', 'windows-1252')
+        self.extractBody = options.get('extract-body',
+                                       'false').lower() == 'true'
+
+        # Unless the contents are needed beforehand, files to wrap are
+        # handed to OFS still open, which copies them in chunks instead of
+        # holding the whole file in memory twice
+        self.wrapOpenFiles = self.concurrency <= 1 and \
+            not self.imageInfo and not self.decompress
+
     def __iter__(self):
 
         for item in self.previous:
@@ -95,106 +180,407 @@ class FilesystemSource(object):
             m = "Metadata is required, but metadata file %s not given or empty"
             raise ValueError(m % self.metadata)
 
-        if not os.path.exists(self.directory):
-            raise ValueError("Directory %s does not exist" % self.directory)
-
-        for dirpath, dirnames, filenames in os.walk(self.directory):
-
-            dirnames.sort()
-            filenames.sort()
-
-            wrapData = self.wrapData
-            # Create folders first, if necessary
-            for dirname in dirnames:
-                dirPath = os.path.join(dirpath, dirname)
-                zodbPath = self.getZODBPath(dirPath)
-
-                if self.ignored(zodbPath)[1]:
-                    continue
-
-                _type = self.folderType
-
-                item = {'_type': self.folderType,
-                        '_path': zodbPath}
-
-                if zodbPath in metadata:
-                    item.update(metadata[zodbPath])
-
-                yield item
-
-            # Then import files
-
-            for filename in filenames:
-                filePath = os.path.join(dirpath, filename)
-                zodbPath = self.getZODBPath(filePath)
-
-                if self.ignored(zodbPath)[1]:
-                    continue
-
-                if self.metadata and \
-                   os.path.abspath(filePath) == os.path.abspath(self.metadata):
-                    continue
-
-                if self.requireMetadata and zodbPath not in metadata:
-                    continue
+        for directory in self.directories:
+            if not os.path.exists(directory):
+                raise ValueError("Directory %s does not exist" % directory)
+
+        entries = self.walk(metadata)
+        if self.concurrency > 1:
+            entries = prefetch(entries, self.readEntry, self.concurrency)
+        else:
+            entries = ((entry, self.readEntry(entry)) for entry in entries)
+        if self.prepareText:
+            entries = self.prepareTexts(entries)
+
+        for (item, fieldname, filePath, wrapData), data in entries:
+            if filePath is not None:
+                correctedMimeType = False
+                if self.imageInfo and item['_mimetype'].startswith('image/'):
+                    info = getImageInfo(data, item['_mimetype'])
+                    if info is not None:
+                        mimeType, width, height = info
+                        item.update({'_width': width, '_height': height})
+                        if mimeType != item['_mimetype']:
+                            item['_mimetype'] = mimeType
+                            correctedMimeType = True
 
-                if zodbPath in metadata and \
-                  'portal_type' in metadata[zodbPath] and \
-                   metadata[zodbPath]['portal_type'] in ['News Item',
-                                                         'Document',
-                                                         'Event']:
-                    # if portal_type is given in metadata.csv, use it!
-                    _type = metadata[zodbPath]['portal_type']
-
-                    mimeType = 'text/html'
-                    fieldname = 'text'
-                    wrapData = False
-                    # if the file is an image: use the image field of the
-                    # news item, otherwise use the text field
-                    if _type == 'News Item':
-                        basename, extension = os.path.splitext(filename)
-                        if extension and \
-                           extension.lower() in mimetypes.types_map and \
-                           mimetypes.types_map[extension.lower()].startswith('image'):
-                            mimeType = mimetypes.types_map[extension.lower()]
-                            fieldname = self.imageField  # the same of news
-                            wrapData = self.wrapData
-
-                else:
-                    # else make it File or Image
-                    _type = self.fileType
-                    fieldname = self.fileField
-                    mimeType = self.defaultMimeType
-
-                    # Try to guess mime type and content type
-                    basename, extension = os.path.splitext(filename)
-                    if extension and extension.lower() in mimetypes.types_map:
-                        mimeType = mimetypes.types_map[extension.lower()]
-                        if mimeType.startswith('image'):
-                            _type = self.imageType
-                            fieldname = self.imageField
-
-                # read in main content of this item
-                infile = open(filePath, 'rb')
                 if wrapData:
-                    fileData = File(filename, filename, infile, mimeType)
-                    fileData.filename = filename
-                else:
-                    fileData = infile.read()
-                infile.close()
-
-                item = {'_type': _type,
-                        '_path': zodbPath,
-                        '_mimetype': mimeType,
-                        fieldname: fileData}
+                    filename = item['_path'].split('/')[-1]
+                    fileData = wrapFile(filename, data, item['_mimetype'])
+                    if self.wrapOpenFiles:
+                        data.close()
+                    data = fileData
+                    if correctedMimeType:
+                        # Trust the image header over the file extension
+                        data.content_type = item['_mimetype']
+                item[fieldname] = data
+
+            if item['_path'] in metadata:
+                item.update(metadata[item['_path']])
 
-                if zodbPath in metadata:
-                    item.update(metadata[zodbPath])
-
-                yield item
+            yield item
 
-    def getZODBPath(self, filePath):
-        zodbPath = filePath[len(self.directory):]
+    def walk(self, metadata):
+        """Yield an ``(item, fieldname, filePath, wrapData)`` tuple for each
+        folder and file to import, in output order. ``filePath`` is None for
+        folders; for files, the contents still have to be read into
+        ``fieldname``.
+
+        With a 'concurrency' above 1, directory entries are stat()ed in a
+        pool of that many threads while walking. With several source
+        directories, each folder is listed in all of them at once, in a
+        pool of one thread per source directory.
+        """
+        if self.concurrency > 1:
+            self.statPool = ThreadPool(self.concurrency)
+        if len(self.directories) > 1:
+            self.listPool = ThreadPool(len(self.directories))
+        try:
+            roots = [(directory, directory) for directory in self.directories]
+            for entry in self.walkFolder(metadata, roots):
+                yield entry
+        finally:
+            for pool in (self.statPool, self.listPool):
+                if pool is not None:
+                    pool.close()
+            self.statPool = None
+            self.listPool = None
+
+    def walkFolder(self, metadata, dirPaths):
+        """Walk the folder made up of the directories ``dirPaths`` (one for
+        each source directory that has it), given as ``(root, dirPath)``
+        pairs with the source directory each one is in. The path of every
+        folder and file is made by getZODBPath() from its own root.
+
+        By default this follows os.walk(): first the folder's subfolders,
+        then its files, then the contents of each subfolder in turn. With
+        depth-first traversal, the folder's files come first, and each
+        subfolder is followed by its entire contents.
+        """
+        dirnames, files = self.listFolder(dirPaths)
+        if self.decompress:
+            files = self.skipCompressedCopies(files, dirnames)
+        depthFirst = self.traversal == 'depth-first'
+
+        if depthFirst:
+            subfolders = (self.subfolderPaths(dirPaths, dirname)
+                          for dirname in dirnames)
+        else:
+            # Kept for walking the subfolders after the files
+            subfolders = Spool(False, self.spoolSize)
+            for dirname in dirnames:
+                subPaths = self.subfolderPaths(dirPaths, dirname)
+                subfolders.append(subPaths)
+                root, path = subPaths[0]
+                entry = self.folderEntry(self.getZODBPath(path, root))
+                if entry is not None:
+                    yield entry
+
+        wrapData = self.wrapData
+        for filename, filePath, root in files:
+            entry = self.fileEntry(metadata, self.getZODBPath(filePath, root),
+                                   filePath, wrapData)
+            if entry is not None:
+                wrapData = entry[3]
+                yield entry
+
+        for subPaths in subfolders:
+            if depthFirst:
+                root, path = subPaths[0]
+                entry = self.folderEntry(self.getZODBPath(path, root))
+                if entry is not None:
+                    yield entry
+
+            # Like os.walk(), do not follow symbolic links to directories
+            subPaths = [(root, path) for root, path in subPaths
+                        if not os.path.islink(path)]
+            if subPaths:
+                for entry in self.walkFolder(metadata, subPaths):
+                    yield entry
+
+    def subfolderPaths(self, dirPaths, dirname):
+        """Return ``(root, path)`` for the subfolder ``dirname`` in each of
+        ``dirPaths`` which has it as a directory, or just in the first one
+        if none does.
+        """
+        subPaths = [(root, os.path.join(dirPath, dirname))
+                    for root, dirPath in dirPaths]
+        if len(subPaths) > 1:
+            subPaths = [(root, path) for root, path in subPaths
+                        if os.path.isdir(path)] or subPaths[:1]
+        return subPaths
+
+    def getZODBPath(self, filePath, directory=None):
+        """Return the path in the ZODB of ``filePath``, a path inside the
+        source directory ``directory`` (by default the first one).
+        """
+        if directory is None:
+            directory = self.directory
+        zodbPath = filePath[len(directory):]
         if os.path.sep != '/':
             zodbPath = zodbPath.replace(os.path.sep, '/')
         return zodbPath
+
+    def folderEntry(self, zodbPath):
+        if self.ignored(zodbPath)[1]:
+            return None
+
+        item = {'_type': self.folderType,
+                '_path': zodbPath}
+
+        return item, None, None, False
+
+    def fileEntry(self, metadata, zodbPath, filePath, wrapData):
+        filename = os.path.basename(filePath)
+
+        # Compressed files are imported under their inner name
+        if self.decompress:
+            basename, extension = os.path.splitext(filename)
+            if extension.lower() in DECOMPRESSORS:
+                filename = basename
+                zodbPath = zodbPath[:-len(extension)]
+            elif extension.lower() == '.xz':
+                logger.warning("No lzma module available, importing %s "
+                               "without decompressing it.", filePath)
+
+        if self.ignored(zodbPath)[1]:
+            return None
+
+        if self.metadata and \
+           os.path.abspath(filePath) == os.path.abspath(self.metadata):
+            return None
+
+        if self.requireMetadata and zodbPath not in metadata:
+            return None
+
+        if zodbPath in metadata and \
+          'portal_type' in metadata[zodbPath] and \
+           metadata[zodbPath]['portal_type'] in TEXT_TYPES:
+            # if portal_type is given in metadata.csv, use it!
+            _type = metadata[zodbPath]['portal_type']
+
+            mimeType = 'text/html'
+            fieldname = 'text'
+            wrapData = False
+            # if the file is an image: use the image field of the
+            # news item, otherwise use the text field
+            if _type == 'News Item':
+                basename, extension = os.path.splitext(filename)
+                if extension and \
+                   extension.lower() in mimetypes.types_map and \
+                   mimetypes.types_map[extension.lower()].startswith('image'):
+                    mimeType = mimetypes.types_map[extension.lower()]
+                    fieldname = self.imageField  # the same of news
+                    wrapData = self.wrapData
+
+        else:
+            # else make it File or Image
+            _type = self.fileType
+            fieldname = self.fileField
+            mimeType = self.defaultMimeType
+
+            # Try to guess mime type and content type
+            basename, extension = os.path.splitext(filename)
+            if extension and extension.lower() in mimetypes.types_map:
+                mimeType = mimetypes.types_map[extension.lower()]
+                if mimeType.startswith('image'):
+                    _type = self.imageType
+                    fieldname = self.imageField
+
+        item = {'_type': _type,
+                '_path': zodbPath,
+                '_mimetype': mimeType}
+
+        return item, fieldname, filePath, wrapData
+
+    def listFolder(self, dirPaths):
+        """List the folder made up of the directories ``dirPaths``, returning
+        its subfolder names and ``(filename, filePath, root)`` for its files.
+
+        With more than one directory, they are listed concurrently and
+        merged by name. A name which is a directory in any of them is a
+        subfolder; otherwise the file from the first directory that has it
+        is used.
+        """
+        if len(dirPaths) == 1:
+            root, dirPath = dirPaths[0]
+            dirnames, filenames = self.listDirectory(dirPath)
+            files = ((filename, os.path.join(dirPath, filename), root)
+                     for filename in filenames)
+            return dirnames, files
+
+        listings = [listing for dirPath, listing in self.listPool.imap(
+                    self.listDirectory, [d for r, d in dirPaths])]
+
+        dirnames = Spool(self.sort, self.spoolSize)
+        for dirname in unique(heapq.merge(*[d for d, f in listings])):
+            dirnames.append(dirname)
+
+        def tag(index, filenames):
+            for filename in filenames:
+                yield filename, index
+
+        def merge():
+            folders = iter(dirnames)
+            folder = next(folders, None)
+            lastName = None
+            # Ties go to the first directory, as heapq.merge() compares index
+            for filename, index in heapq.merge(
+                    *[tag(index, filenames) for index, (d, filenames)
+                      in enumerate(listings)]):
+                if filename == lastName:
+                    continue
+                lastName = filename
+                # Both are sorted, so step through the folders alongside
+                while folder is not None and folder < filename:
+                    folder = next(folders, None)
+                if folder != filename:
+                    root, dirPath = dirPaths[index]
+                    yield filename, os.path.join(dirPath, filename), root
+
+        return dirnames, merge()
+
+    def skipCompressedCopies(self, files, dirnames):
+        """Skip compressed files which would be imported under the same path
+        as another file or folder in the same folder: an uncompressed file
+        or a folder always wins, otherwise the compressed copies are used in
+        the order of COMPRESSION_PREFERENCE, whatever the case of their
+        suffix. Between copies with the same suffix in a different case,
+        the name which sorts first wins.
+
+        The folder is listed once to find the clashes, so the listing is
+        kept in spools meanwhile; only the names of the skipped files are
+        held in memory.
+        """
+        # (name imported as, rank, filename), where the lowest sorts first
+        names = Spool(True, self.spoolSize)
+        listing = Spool(False, self.spoolSize)
+        for dirname in dirnames:
+            names.append((dirname, 0, dirname))
+        for filename, filePath, root in files:
+            basename, extension = os.path.splitext(filename)
+            extension = extension.lower()
+            if extension in DECOMPRESSORS:
+                rank = 1 + COMPRESSION_PREFERENCE.index(extension)
+                names.append((basename, rank, filename))
+            else:
+                names.append((filename, 0, filename))
+            listing.append((filename, filePath, root))
+
+        skipped = set()
+        lastName = None
+        for name, rank, filename in names:
+            if name == lastName:
+                skipped.add(filename)
+            lastName = name
+
+        for filename, filePath, root in listing:
+            if filename not in skipped:
+                yield filename, filePath, root
+
+    def listDirectory(self, path):
+        """Return the names of the subdirectories and files in the directory
+        ``path``. Like os.walk(), an unreadable directory is taken to be
+        empty.
+        """
+        if self.streaming:
+            listing = scandirectory(path, self.sort, self.spoolSize,
+                                    self.statPool)
+            if listing is None:
+                return [], []
+            return listing
+
+        try:
+            names = os.listdir(path)
+        except OSError:
+            return [], []
+
+        def isDirectory(name):
+            return self.isDirectory(os.path.join(path, name))
+
+        if self.statPool is None:
+            stats = ((name, isDirectory(name)) for name in names)
+        else:
+            stats = self.statPool.imap(isDirectory, names)
+
+        dirnames = []
+        filenames = []
+        for name, isdir in stats:
+            if isdir:
+                dirnames.append(name)
+            else:
+                filenames.append(name)
+
+        if self.sort:
+            dirnames.sort()
+            filenames.sort()
+        return dirnames, filenames
+
+    def isDirectory(self, path):
+        return os.path.isdir(path)
+
+    def prepareTexts(self, entries):
+        """Run prepareText() over the contents of each entry which goes into
+        the text field of a Document, Event or News Item. With more than one
+        of 'text-processes', this happens in a process pool, but entries are
+        still yielded in order.
+        """
+        args = (self.fallbackCharset, self.extractBody)
+
+        if self.textProcesses <= 1:
+            for entry, data in entries:
+                if self.isText(entry):
+                    data = prepareText(data, *args)
+                yield entry, data
+            return
+
+        def finish(pending):
+            entry, data, result = pending
+            if result is not None:
+                data = result.get()
+            return entry, data
+
+        pool = multiprocessing.Pool(self.textProcesses)
+        window = deque()
+        try:
+            for entry, data in entries:
+                result = None
+                if self.isText(entry):
+                    result = pool.apply_async(prepareText, (data,) + args)
+                window.append((entry, data, result))
+                if len(window) > 2 * self.textProcesses:
+                    yield finish(window.popleft())
+
+            while window:
+                yield finish(window.popleft())
+        finally:
+            pool.terminate()
+
+    def isText(self, entry):
+        item, fieldname, filePath, wrapData = entry
+        return item['_type'] in TEXT_TYPES and fieldname == 'text'
+
+    def readEntry(self, entry):
+        """Read in the main content of a file entry produced by walk(), or
+        just open it if it is to be wrapped as it is.
+        """
+        item, fieldname, filePath, wrapData = entry
+        if filePath is None:
+            return None
+        if wrapData and self.wrapOpenFiles:
+            return self.openFile(filePath)
+        return self.readFile(filePath)
+
+    def readFile(self, filePath):
+        infile = self.openFile(filePath)
+        try:
+            return infile.read()
+        finally:
+            infile.close()
+
+    def openFile(self, filePath):
+        if self.decompress:
+            basename, extension = os.path.splitext(filePath)
+            if extension.lower() in DECOMPRESSORS:
+                return DECOMPRESSORS[extension.lower()](filePath)
+        return open(filePath, 'rb')
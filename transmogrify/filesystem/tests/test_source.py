@@ -1,6 +1,52 @@
 import os
+import bz2
+import gzip
+import logging
+import mimetypes
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from transmogrify.filesystem.source import DECOMPRESSORS
 from transmogrify.filesystem.source import FilesystemSource
+from transmogrify.filesystem.text import prepareText
+
+
+class SlowFilesystemSource(FilesystemSource):
+    """Simulates a high-latency network filesystem, keeping track of how
+    many reads and stats were in flight at once.
+    """
+
+    latency = 0.05
+
+    def __init__(self, *args, **kwargs):
+        super(SlowFilesystemSource, self).__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.inFlight = {'read': 0, 'stat': 0}
+        self.maxInFlight = {'read': 0, 'stat': 0}
+
+    def slow(self, kind, function, *args):
+        with self.lock:
+            self.inFlight[kind] += 1
+            self.maxInFlight[kind] = max(self.maxInFlight[kind],
+                                         self.inFlight[kind])
+        try:
+            time.sleep(self.latency)
+            return function(*args)
+        finally:
+            with self.lock:
+                self.inFlight[kind] -= 1
+
+    def readFile(self, filePath):
+        return self.slow('read',
+                         super(SlowFilesystemSource, self).readFile, filePath)
+
+    def isDirectory(self, path):
+        return self.slow('stat',
+                         super(SlowFilesystemSource, self).isDirectory, path)
 
 
 class FilesystemSourceTest(unittest.TestCase):
@@ -587,5 +633,554 @@ class FilesystemSourceTest(unittest.TestCase):
      
         # Note: items without metadata were ignored           
 
+    def test_concurrency(self):
+        options = {'directory':   'transmogrify.filesystem.tests:data',
+                   'ignored':     're:.*\.svn.*\nre:.*\.DS_Store\n',
+                   'wrap-data':   'false'}
+        expected = list(self._makeOne(**options))
+
+        options['concurrency'] = '2'
+        source = SlowFilesystemSource({}, 'test', options, ())
+        results = list(source)
+
+        # Same items, in the same order
+        self.assertEquals(expected, results)
+
+        # Reads overlapped, but never beyond the configured limit
+        self.assertEquals(2, source.maxInFlight['read'])
+
+        # And so did stats while listing directories
+        self.assertEquals(2, source.maxInFlight['stat'])
+
+    def test_concurrency_off(self):
+        options = {'directory':   'transmogrify.filesystem.tests:data',
+                   'ignored':     're:.*\.svn.*\nre:.*\.DS_Store\n',
+                   'wrap-data':   'false'}
+        source = SlowFilesystemSource({}, 'test', options, ())
+        list(source)
+
+        self.assertEquals(1, source.maxInFlight['read'])
+        self.assertEquals(1, source.maxInFlight['stat'])
+
+    def test_wrap_open_files(self):
+        options = {'directory':   'transmogrify.filesystem.tests:data',
+                   'ignored':     're:.*\.svn.*\nre:.*\.DS_Store\n'}
+        source = self._makeOne(**options)
+
+        # Files to wrap are handed to OFS open, not read in as a whole
+        def readFile(filePath):
+            raise AssertionError(filePath)
+        source.readFile = readFile
+        opened = []
+        openFile = source.openFile
+        def recordingOpenFile(filePath):
+            opened.append(openFile(filePath))
+            return opened[-1]
+        source.openFile = recordingOpenFile
+
+        results = list(source)
+        self.assertEquals('Sample text file',            str(results[3]['file'].data))
+        self.assertEquals(4, len(opened))
+        self.assertEquals([True] * 4, [f.closed for f in opened])
+
+        # But read in if the contents are needed first
+        for name, value in [('concurrency', '2'),
+                            ('image-info', 'true'),
+                            ('decompress', 'true')]:
+            source = self._makeOne(**dict(options, **{name: value}))
+            self.failIf(source.wrapOpenFiles)
+            results = list(source)
+            self.assertEquals('Sample text file',        str(results[3]['file'].data))
+
+    def test_concurrency_error(self):
+        options = {'directory':   'transmogrify.filesystem.tests:data',
+                   'ignored':     're:.*\.svn.*\nre:.*\.DS_Store\n',
+                   'concurrency': '4'}
+        source = self._makeOne(**options)
+
+        def readFile(filePath):
+            raise IOError(filePath)
+        source.readFile = readFile
+
+        results = iter(source)
+        self.assertEquals({'_path': '/subdir', '_type': 'Folder'}, results.next())
+        self.assertRaises(IOError, results.next)
+
+    def test_streaming(self):
+        options = {'directory':   'transmogrify.filesystem.tests:data',
+                   'ignored':     're:.*\.svn.*\nre:.*\.DS_Store\n',
+                   'wrap-data':   'false'}
+        expected = list(self._makeOne(**options))
+
+        options['streaming'] = 'true'
+        self.assertEquals(expected, list(self._makeOne(**options)))
+
+        # Spill every name to disk, merging the sorted runs again
+        options['spool-size'] = '1'
+        self.assertEquals(expected, list(self._makeOne(**options)))
+
+    def test_streaming_unsorted(self):
+        options = {'directory':   'transmogrify.filesystem.tests:data',
+                   'ignored':     're:.*\.svn.*\nre:.*\.DS_Store\n',
+                   'wrap-data':   'false',
+                   'streaming':   'true',
+                   'sort':        'false',
+                   'spool-size':  '2'}
+        results = list(self._makeOne(**options))
+        self.assertEquals(6, len(results))
+
+        # Native order within a directory, but folders still come first
+        # and parents still come before their children
+        self.assertEquals({'_path': '/subdir', '_type': 'Folder'}, results[0])
+        self.assertEquals(['/logo.jpg', '/noextension', '/textfile.txt'],
+                          sorted([r['_path'] for r in results[1:4]]))
+        self.assertEquals({'_path': '/subdir/subsubdir', '_type': 'Folder'}, results[4])
+        self.assertEquals('/subdir/subsubdir/other.txt', results[5]['_path'])
+
+    def test_decompress(self):
+        options = {'directory':   'transmogrify.filesystem.tests:compressed',
+                   'ignored':     're:.*\.svn.*\nre:.*\.DS_Store\n',
+                   'decompress':  'true'}
+        source = self._makeOne(**options)
+        results = list(source)
+        self.assertEquals(2, len(results))
+
+        # Compression suffix is stripped, mimetype guessed from the rest
+        self.assertEquals('image/jpeg',                  results[0]['_mimetype'])
+        self.assertEquals('/logo.jpg',                   results[0]['_path'])
+        self.assertEquals('Image',                       results[0]['_type'])
+        self.assertEquals('logo.jpg',                    results[0]['image'].filename)
+        self.assertEquals('logo.jpg',                    results[0]['image'].id())
+        self.assertEquals('image/jpeg',                  results[0]['image'].content_type)
+
+        datadir = os.path.join(os.path.dirname(__file__), 'data')
+        logo = open(os.path.join(datadir, 'logo.jpg'), 'rb').read()
+        self.assertEquals(logo,                          str(results[0]['image'].data))
+
+        self.assertEquals('text/plain',                  results[1]['_mimetype'])
+        self.assertEquals('/textfile.txt',               results[1]['_path'])
+        self.assertEquals('File',                        results[1]['_type'])
+        self.assertEquals('textfile.txt',                results[1]['file'].filename)
+        self.assertEquals('Sample text file',            str(results[1]['file'].data))
+
+    def test_decompress_clash(self):
+        options = {'directory':   'transmogrify.filesystem.tests:clash',
+                   'ignored':     're:.*\.svn.*\nre:.*\.DS_Store\n',
+                   'wrap-data':   'false',
+                   'decompress':  'true'}
+        source = self._makeOne(**options)
+        results = list(source)
+
+        # Each path only once: the uncompressed file wins, otherwise .gz
+        # wins over .bz2
+        self.assertEquals([('/notes.txt', 'gz'), ('/report.txt', 'plain')],
+                          [(r['_path'], r['file']) for r in results])
+
+    def test_decompress_clash_case(self):
+        # Not a fixture, since these names cannot all exist side by side on
+        # a case-insensitive filesystem
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for filename, opener in [('x.txt.GZ', gzip.GzipFile),
+                                 ('x.txt.gz', gzip.GzipFile),
+                                 ('y.txt.bz2', bz2.BZ2File),
+                                 ('y.txt.GZ', gzip.GzipFile),
+                                 ('Z.txt.Bz2', bz2.BZ2File),
+                                 ('z.txt.gz', gzip.GzipFile)]:
+            outfile = opener(os.path.join(directory, filename), 'wb')
+            outfile.write(filename)
+            outfile.close()
+
+        options = {'directory':   directory,
+                   'wrap-data':   'false',
+                   'decompress':  'true'}
+        results = list(self._makeOne(**options))
+
+        # Suffixes match whatever their case, but the path is kept as is
+        self.assertEquals([('/Z.txt', 'Z.txt.Bz2'),
+                           ('/x.txt', 'x.txt.GZ'),
+                           ('/y.txt', 'y.txt.GZ'),
+                           ('/z.txt', 'z.txt.gz')],
+                          [(r['_path'], r['file']) for r in results])
+
+    def test_decompress_without_lzma(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        open(os.path.join(directory, 'data.xz'), 'wb').close()
+
+        messages = []
+        handler = logging.Handler()
+        handler.emit = lambda record: messages.append(record.getMessage())
+        logger = logging.getLogger('transmogrify.filesystem')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+
+        saved = DECOMPRESSORS.pop('.xz', None)
+        try:
+            options = {'directory':   directory,
+                       'wrap-data':   'false',
+                       'decompress':  'true'}
+            results = list(self._makeOne(**options))
+        finally:
+            if saved is not None:
+                DECOMPRESSORS['.xz'] = saved
+
+        # Imported as it is, but not silently
+        self.assertEquals(['/data.xz'], [r['_path'] for r in results])
+        self.assertEquals(1, len(messages))
+        self.assertTrue('data.xz' in messages[0])
+
+    def test_decompress_off(self):
+        options = {'directory':   'transmogrify.filesystem.tests:compressed',
+                   'ignored':     're:.*\.svn.*\nre:.*\.DS_Store\n'}
+        source = self._makeOne(**options)
+        results = list(source)
+        self.assertEquals(['/logo.jpg.bz2', '/textfile.txt.gz'],
+                          [r['_path'] for r in results])
+
+    def test_image_info(self):
+        options = {'directory':   'transmogrify.filesystem.tests:data',
+                   'ignored':     're:.*\.svn.*\nre:.*\.DS_Store\n',
+                   'image-info':  'true'}
+        source = self._makeOne(**options)
+        results = list(source)
+        self.assertEquals(6, len(results))
+
+        self.assertEquals('image/jpeg',                  results[1]['_mimetype'])
+        self.assertEquals('/logo.jpg',                   results[1]['_path'])
+        self.assertEquals(252,                           results[1]['_width'])
+        self.assertEquals(57,                            results[1]['_height'])
+
+        # Only images are inspected
+        self.failIf('_width' in results[3])
+
+    def test_image_info_formats(self):
+        options = {'directory':   'transmogrify.filesystem.tests:images',
+                   'ignored':     're:.*\.svn.*\nre:.*\.DS_Store\n',
+                   'image-info':  'true'}
+        source = self._makeOne(**options)
+        results = list(source)
+        self.assertEquals(4, len(results))
+
+        # The mimetype guessed from the extension is corrected
+        self.assertEquals('/mislabelled.jpg',            results[0]['_path'])
+        self.assertEquals('image/png',                   results[0]['_mimetype'])
+        self.assertEquals('image/png',                   results[0]['image'].content_type)
+        self.assertEquals((3, 2),                        (results[0]['_width'], results[0]['_height']))
+
+        self.assertEquals('/pixels.bmp',                 results[1]['_path'])
+        self.assertEquals((2, 3),                        (results[1]['_width'], results[1]['_height']))
+
+        self.assertEquals('image/gif',                   results[2]['_mimetype'])
+        self.assertEquals((4, 5),                        (results[2]['_width'], results[2]['_height']))
+
+        self.assertEquals('image/png',                   results[3]['_mimetype'])
+        self.assertEquals((3, 2),                        (results[3]['_width'], results[3]['_height']))
+
+    def test_image_info_alias(self):
+        # As the mimetypes module has it on Python 2
+        saved = mimetypes.types_map.get('.bmp')
+        mimetypes.types_map['.bmp'] = 'image/x-ms-bmp'
+        try:
+            options = {'directory':   'transmogrify.filesystem.tests:images',
+                       'ignored':     're:.*\.svn.*\nre:.*\.DS_Store\n',
+                       'image-info':  'true'}
+            results = list(self._makeOne(**options))
+        finally:
+            if saved is None:
+                del mimetypes.types_map['.bmp']
+            else:
+                mimetypes.types_map['.bmp'] = saved
+
+        # Another name for the format found is kept
+        self.assertEquals('/pixels.bmp',                 results[1]['_path'])
+        self.assertEquals('image/x-ms-bmp',              results[1]['_mimetype'])
+        self.assertEquals('image/x-ms-bmp',              results[1]['image'].content_type)
+        self.assertEquals((2, 3),                        (results[1]['_width'], results[1]['_height']))
+
+    def test_prepare_text(self):
+        options = {'directory':    'transmogrify.filesystem.tests:text',
+                   'metadata':     'transmogrify.filesystem.tests:text/text.csv',
+                   'ignored':      're:.*\.svn.*\nre:.*\.DS_Store\n',
+                   'wrap-data':    'false',
+                   'prepare-text': 'true'}
+        source = self._makeOne(**options)
+        results = list(source)
+        self.assertEquals(4, len(results))
+
+        # No charset declared and not UTF-8: fallback charset
+        self.assertEquals('/latin1.html',                results[0]['_path'])
+        self.assertEquals('Document',                    results[0]['_type'])
+        self.assertEquals('text/html',                   results[0]['_mimetype'])
+        self.assertEquals('<p>Caf\xc3\xa9 \xe2\x80\x9cmenu\xe2\x80\x9d</p>',
+                          results[0]['text'])
+
+        # Charset from <meta>, line endings normalised
+        self.assertEquals('Event',                       results[1]['_type'])
+        self.assertTrue(results[1]['text'].endswith('<p>Price: 5 \xe2\x82\xac</p>\n'))
+        self.failIf('\r' in results[1]['text'])
+
+        # Byte order mark dropped, unicode normalised to NFC
+        self.assertEquals('News Item',                   results[2]['_type'])
+        self.assertTrue(results[2]['text'].startswith('<html>'))
+        self.assertTrue('<p>Caf\xc3\xa9</p>' in results[2]['text'])
+
+        # Ordinary files are left alone
+        self.assertEquals('/plain.txt',                  results[3]['_path'])
+        self.assertEquals('Caf\xe9',                     results[3]['file'])
+
+    def test_prepare_text_processes(self):
+        options = {'directory':    'transmogrify.filesystem.tests:text',
+                   'metadata':     'transmogrify.filesystem.tests:text/text.csv',
+                   'ignored':      're:.*\.svn.*\nre:.*\.DS_Store\n',
+                   'wrap-data':    'false',
+                   'prepare-text': 'true'}
+        expected = list(self._makeOne(**options))
+
+        options['text-processes'] = '2'
+        self.assertEquals(expected, list(self._makeOne(**options)))
+
+    def test_extract_body(self):
+        options = {'directory':    'transmogrify.filesystem.tests:text',
+                   'metadata':     'transmogrify.filesystem.tests:text/text.csv',
+                   'ignored':      're:.*\.svn.*\nre:.*\.DS_Store\n',
+                   'prepare-text': 'true',
+                   'extract-body': 'true'}
+        source = self._makeOne(**options)
+        results = list(source)
+
+        self.assertEquals('<p>Caf\xc3\xa9</p>',          results[2]['text'])
+
+        # Fragments without a <body> are kept whole
+        self.assertEquals('<p>Caf\xc3\xa9 \xe2\x80\x9cmenu\xe2\x80\x9d</p>',
+                          results[0]['text'])
+
+    def test_prepare_text_meta_utf16(self):
+        # The declaration cannot be true of data we could read it in
+        self.assertEquals('<meta charset="utf-16"><p>hi</p>',
+                          prepareText('<meta charset="utf-16"><p>hi</p>'))
+        self.assertEquals('<meta charset="UTF-32BE"><p>Caf\xc3\xa9</p>',
+                          prepareText('<meta charset="UTF-32BE"><p>Caf\xe9</p>'))
+
+    def test_prepare_text_meta_not_a_charset(self):
+        # Codecs which are not text encodings fall through to UTF-8 or the
+        # fallback charset
+        for codec in ('hex', 'base64', 'zlib', 'bz2', 'uu', 'quopri',
+                      'rot13', 'idna', 'string_escape', 'unicode_escape'):
+            data = '<meta charset="%s"><p>Caf\xc3\xa9 \\n</p>' % codec
+            self.assertEquals(data, prepareText(data))
+            data = '<meta charset="%s"><p>Caf\xe9 \\n</p>' % codec
+            self.assertEquals(data.replace('\xe9', '\xc3\xa9'),
+                              prepareText(data))
+
+    def test_ofs_only_imported_to_wrap(self):
+        options = {'directory':   'transmogrify.filesystem.tests:data',
+                   'ignored':     're:.*\.svn.*\nre:.*\.DS_Store\n',
+                   'wrap-data':   'false'}
+
+        # Make OFS unimportable
+        saved = sys.modules.get('OFS.Image')
+        sys.modules['OFS.Image'] = None
+        try:
+            source = self._makeOne(**options)
+            self.assertEquals(6, len(list(source)))
+
+            del options['wrap-data']
+            source = self._makeOne(**options)
+            self.assertRaises(ImportError, list, source)
+        finally:
+            if saved is None:
+                del sys.modules['OFS.Image']
+            else:
+                sys.modules['OFS.Image'] = saved
+
+    def test_import_without_ofs(self):
+        # A fresh interpreter, since OFS may well be loaded in this one
+        code = ("import sys; import transmogrify.filesystem.source; "
+                "sys.exit('OFS.Image' in sys.modules)")
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        self.assertEquals(0, subprocess.call([sys.executable, '-c', code],
+                                             env=env))
+
+    def test_multiple_directories(self):
+        options = {'directory':   'transmogrify.filesystem.tests:data\n'
+                                  'transmogrify.filesystem.tests:overlay',
+                   'ignored':     're:.*\.svn.*\nre:.*\.DS_Store\n',
+                   'wrap-data':   'false'}
+        source = self._makeOne(**options)
+        results = list(source)
+
+        # One pass, in walk order, with each path only once
+        self.assertEquals(['/newdir',
+                           '/noextension',
+                           '/subdir',
+                           '/logo.jpg',
+                           '/textfile.txt',
+                           '/newdir/file.txt',
+                           '/noextension/inner.txt',
+                           '/subdir/subsubdir',
+                           '/subdir/extra.txt',
+                           '/subdir/subsubdir/other.txt'],
+                          [r['_path'] for r in results])
+
+        # A folder wins over a file with the same path
+        self.assertEquals({'_path': '/noextension', '_type': 'Folder'}, results[1])
+
+        # Otherwise the first directory wins
+        self.assertEquals('Sample text file',            results[4]['file'])
+
+        options['directory'] = ('transmogrify.filesystem.tests:overlay\n'
+                                'transmogrify.filesystem.tests:data')
+        results = list(self._makeOne(**options))
+        self.assertEquals('Overlay text file',           results[4]['file'])
+
+    def test_multiple_directories_streaming(self):
+        options = {'directory':   'transmogrify.filesystem.tests:data\n'
+                                  'transmogrify.filesystem.tests:overlay',
+                   'ignored':     're:.*\.svn.*\nre:.*\.DS_Store\n',
+                   'wrap-data':   'false'}
+        expected = list(self._makeOne(**options))
+
+        options['streaming'] = 'true'
+        options['spool-size'] = '1'
+        self.assertEquals(expected, list(self._makeOne(**options)))
+
+    def test_multiple_directories_threads(self):
+        options = {'directory':   'transmogrify.filesystem.tests:data\n'
+                                  'transmogrify.filesystem.tests:overlay',
+                   'ignored':     're:.*\.svn.*\nre:.*\.DS_Store\n',
+                   'wrap-data':   'false'}
+        source = self._makeOne(**options)
+
+        pools = []
+        mainThread = threading.current_thread()
+        listDirectory = source.listDirectory
+        def recordingListDirectory(path):
+            if threading.current_thread() is not mainThread:
+                pools.append(source.listPool)
+            return listDirectory(path)
+        source.listDirectory = recordingListDirectory
+        list(source)
+
+        # Folders in both directories were all listed in one pool, which
+        # was closed afterwards
+        self.assertEquals(4, len(pools))
+        self.assertEquals(1, len(set(pools)))
+        self.assertEquals(None, source.listPool)
+
+    def test_multiple_directories_not_found(self):
+        options = {'directory':   'transmogrify.filesystem.tests:data\n'
+                                  'transmogrify.filesystem.tests:invalid'}
+        source = self._makeOne(**options)
+        self.assertRaises(ValueError, list, source)
+
+    def test_no_directory(self):
+        self.assertRaises(ValueError, self._makeOne, directory='\n  \n')
+
+    def test_multiple_directories_unsorted(self):
+        options = {'directory':   'transmogrify.filesystem.tests:data\n'
+                                  'transmogrify.filesystem.tests:overlay',
+                   'sort':        'false'}
+        self.assertRaises(ValueError, self._makeOne, **options)
+
+    def test_depth_first(self):
+        options = {'directory':   'transmogrify.filesystem.tests:data',
+                   'ignored':     're:.*\.svn.*\nre:.*\.DS_Store\n',
+                   'traversal':   'depth-first'}
+        source = self._makeOne(**options)
+        results = list(source)
+        self.assertEquals(6, len(results))
+
+        # Files of a folder come first
+        self.assertEquals('/logo.jpg',                   results[0]['_path'])
+        self.assertEquals('Image',                       results[0]['_type'])
+        self.assertEquals('logo.jpg',                    results[0]['image'].filename)
+        self.assertEquals('/noextension',                results[1]['_path'])
+        self.assertEquals('/textfile.txt',               results[2]['_path'])
+
+        # Then each subfolder, followed by all of its contents
+        self.assertEquals({'_path': '/subdir', '_type': 'Folder'}, results[3])
+        self.assertEquals({'_path': '/subdir/subsubdir', '_type': 'Folder'}, results[4])
+        self.assertEquals('/subdir/subsubdir/other.txt', results[5]['_path'])
+
+    def test_depth_first_multiple_directories(self):
+        options = {'directory':   'transmogrify.filesystem.tests:data\n'
+                                  'transmogrify.filesystem.tests:overlay',
+                   'ignored':     're:.*\.svn.*\nre:.*\.DS_Store\n',
+                   'wrap-data':   'false',
+                   'traversal':   'depth-first'}
+        results = list(self._makeOne(**options))
+        self.assertEquals(['/logo.jpg',
+                           '/textfile.txt',
+                           '/newdir',
+                           '/newdir/file.txt',
+                           '/noextension',
+                           '/noextension/inner.txt',
+                           '/subdir',
+                           '/subdir/extra.txt',
+                           '/subdir/subsubdir',
+                           '/subdir/subsubdir/other.txt'],
+                          [r['_path'] for r in results])
+
+        # The same items as with the default traversal
+        del options['traversal']
+        expected = list(self._makeOne(**options))
+        self.assertEquals(sorted(expected), sorted(results))
+
+    def test_zodb_path(self):
+        options = {'directory':   'transmogrify.filesystem.tests:data\n'
+                                  'transmogrify.filesystem.tests:overlay'}
+        source = self._makeOne(**options)
+        data, overlay = source.directories
+
+        self.assertEquals('/subdir/subsubdir/other.txt', source.getZODBPath(
+            os.path.join(data, 'subdir', 'subsubdir', 'other.txt')))
+        self.assertEquals('/newdir/file.txt', source.getZODBPath(
+            os.path.join(overlay, 'newdir', 'file.txt'), overlay))
+
+    def test_zodb_path_override(self):
+        class PrefixedSource(FilesystemSource):
+            # Put each source directory's contents under a folder of its own
+            def getZODBPath(self, filePath, directory=None):
+                if directory is None:
+                    directory = self.directory
+                return '/' + os.path.basename(directory) + \
+                    FilesystemSource.getZODBPath(self, filePath, directory)
+
+        options = {'directory':   'transmogrify.filesystem.tests:data',
+                   'ignored':     're:.*\.svn.*\nre:.*\.DS_Store\n',
+                   'wrap-data':   'false'}
+        results = list(PrefixedSource({}, 'test', options, ()))
+        self.assertEquals(['/data/subdir',
+                           '/data/logo.jpg',
+                           '/data/noextension',
+                           '/data/textfile.txt',
+                           '/data/subdir/subsubdir',
+                           '/data/subdir/subsubdir/other.txt'],
+                          [r['_path'] for r in results])
+
+        # Each path is made from the source directory the entry is in; a
+        # folder in several of them from the first one
+        options['directory'] = ('transmogrify.filesystem.tests:data\n'
+                                'transmogrify.filesystem.tests:overlay')
+        options['traversal'] = 'depth-first'
+        results = list(PrefixedSource({}, 'test', options, ()))
+        self.assertEquals(['/data/logo.jpg',
+                           '/data/textfile.txt',
+                           '/overlay/newdir',
+                           '/overlay/newdir/file.txt',
+                           '/overlay/noextension',
+                           '/overlay/noextension/inner.txt',
+                           '/data/subdir',
+                           '/overlay/subdir/extra.txt',
+                           '/data/subdir/subsubdir',
+                           '/data/subdir/subsubdir/other.txt'],
+                          [r['_path'] for r in results])
+
+    def test_unknown_traversal(self):
+        options = {'directory':   'transmogrify.filesystem.tests:data',
+                   'traversal':   'sideways'}
+        self.assertRaises(ValueError, self._makeOne, **options)
+
 def test_suite():
     return unittest.defaultTestLoader.loadTestsFromName(__name__)
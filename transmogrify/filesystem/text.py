@@ -0,0 +1,92 @@
+import re
+import codecs
+import unicodedata
+
+BOMS = [(codecs.BOM_UTF8, 'utf-8'),
+        (codecs.BOM_UTF32_LE, 'utf-32'),
+        (codecs.BOM_UTF32_BE, 'utf-32'),
+        (codecs.BOM_UTF16_LE, 'utf-16'),
+        (codecs.BOM_UTF16_BE, 'utf-16')]
+
+META_CHARSET = re.compile(r'<meta[^>]+charset\s*=\s*["\']?([\w.:-]+)',
+                          re.IGNORECASE)
+
+# Text codecs which decode ASCII unchanged, but are not charsets
+ESCAPE_CODECS = ['unicode-escape', 'raw-unicode-escape']
+
+BODY = re.compile(r'<body[^>]*>(.*?)(?:</body>|$)', re.IGNORECASE | re.DOTALL)
+
+
+def detectCharset(data, fallbackCharset):
+    """Guess the charset of a text or HTML file from its byte order mark,
+    a ``<meta>`` charset declaration, or by trying UTF-8, in that order.
+
+    A ``<meta>`` declaration is ignored unless it names a charset which
+    decodes the declaration itself back to the same text. It was found by
+    reading the data as ASCII, so this rules out UTF-16 and UTF-32 as well
+    as codecs such as ``hex``, ``zlib`` or ``rot13``, which are not text
+    encodings at all.
+    """
+
+    for bom, charset in BOMS:
+        if data.startswith(bom):
+            return charset
+
+    match = META_CHARSET.search(data[:1024])
+    if match is not None:
+        charset = checkCharset(match.group(1), match.group(0))
+        if charset is not None:
+            return charset
+
+    try:
+        data.decode('utf-8')
+    except UnicodeDecodeError:
+        return fallbackCharset
+    return 'utf-8'
+
+
+def checkCharset(name, declaration):
+    """Return the normalised name of the charset ``name``, or None if it is
+    unknown or does not decode the ASCII ``declaration`` of it unchanged.
+    """
+    try:
+        charset = codecs.lookup(name).name
+    except LookupError:
+        return None
+    if charset in ESCAPE_CODECS:
+        return None
+
+    try:
+        text = declaration.decode(charset, 'replace')
+    except Exception:
+        # Codecs which are not text encodings fail in all sorts of ways
+        return None
+    expected = declaration.decode('ascii', 'replace')
+    if type(text) is not type(expected) or text != expected:
+        return None
+    return charset
+
+
+def prepareText(data, fallbackCharset='windows-1252', extractBody=False):
+    """Turn the raw contents of a file into a normalised UTF-8 string for a
+    rich text field: decode it in its detected charset, normalise unicode
+    to NFC form and line endings to ``\\n``, and optionally keep just the
+    contents of the HTML ``<body>``.
+
+    This is a module level function so that it can run in a process pool.
+    """
+
+    charset = detectCharset(data, fallbackCharset)
+    text = data.decode(charset, 'replace')
+    if text.startswith(u'\ufeff'):
+        text = text[1:]
+
+    text = unicodedata.normalize('NFC', text)
+    text = text.replace(u'\r\n', u'\n').replace(u'\r', u'\n')
+
+    if extractBody:
+        match = BODY.search(text)
+        if match is not None:
+            text = match.group(1).strip()
+
+    return text.encode('utf-8')
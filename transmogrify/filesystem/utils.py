@@ -0,0 +1,204 @@
+import os
+import heapq
+import marshal
+import struct
+import tempfile
+import threading
+from itertools import chain
+from collections import deque
+from Queue import Queue
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+class _Pending(object):
+    """A job handed to a worker thread, and its eventual result.
+    """
+
+    def __init__(self, function, job):
+        self.function = function
+        self.job = job
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class ThreadPool(object):
+    """A fixed number of daemon worker threads, which can be reused for
+    any number of imap() calls until the pool is closed.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.queue = Queue()
+        self.workers = [threading.Thread(target=self.work)
+                        for i in range(size)]
+        for worker in self.workers:
+            worker.setDaemon(True)
+            worker.start()
+
+    def work(self):
+        while True:
+            pending = self.queue.get()
+            if pending is None:
+                return
+            try:
+                pending.result = pending.function(pending.job)
+            except Exception as e:
+                pending.error = e
+            pending.done.set()
+
+    def imap(self, function, jobs):
+        """Apply ``function`` to each of ``jobs`` in the worker threads,
+        yielding ``(job, result)`` pairs in the original order of ``jobs``.
+
+        At most ``size`` jobs of each call are in flight at any time, so
+        ``jobs`` may be a lazy (or infinite) iterator. Exceptions raised by
+        ``function`` are re-raised in the consuming thread when their job
+        is reached.
+        """
+        window = deque()
+        jobs = iter(jobs)
+        while True:
+            while len(window) < self.size:
+                try:
+                    job = next(jobs)
+                except StopIteration:
+                    break
+                pending = _Pending(function, job)
+                window.append(pending)
+                self.queue.put(pending)
+
+            if not window:
+                break
+
+            pending = window.popleft()
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            yield pending.job, pending.result
+
+    def close(self):
+        """Let the worker threads exit once they have finished the jobs
+        already handed to them.
+        """
+        for worker in self.workers:
+            self.queue.put(None)
+
+
+def prefetch(jobs, function, size):
+    """Apply ``function`` to each of ``jobs`` in up to ``size`` worker threads,
+    yielding ``(job, result)`` pairs in the original order of ``jobs``.
+
+    This is ThreadPool.imap() on a pool of its own, which is closed when
+    the jobs run out or the generator is discarded.
+    """
+    pool = ThreadPool(size)
+    try:
+        for job, result in pool.imap(function, jobs):
+            yield job, result
+    finally:
+        pool.close()
+
+
+class Spool(object):
+    """An append-only sequence of names which keeps at most ``size`` of them
+    in memory, spilling the rest to temporary files in runs.
+
+    Iterating yields the names in sorted order if ``sort`` is true (merging
+    the sorted runs from disk), or in the order they were appended
+    otherwise. A spool may be iterated over more than once, but not
+    concurrently.
+    """
+
+    def __init__(self, sort=True, size=100000):
+        self.sort = sort
+        self.size = size
+        self.names = []
+        self.runs = []
+
+    def append(self, name):
+        self.names.append(name)
+        if len(self.names) >= self.size:
+            self.spill()
+
+    def spill(self):
+        if self.sort:
+            self.names.sort()
+        run = tempfile.TemporaryFile()
+        for name in self.names:
+            data = marshal.dumps(name)
+            run.write(struct.pack('>I', len(data)))
+            run.write(data)
+        self.runs.append(run)
+        self.names = []
+
+    def readRun(self, run):
+        run.seek(0)
+        while True:
+            header = run.read(4)
+            if not header:
+                return
+            length, = struct.unpack('>I', header)
+            yield marshal.loads(run.read(length))
+
+    def __iter__(self):
+        runs = [self.readRun(run) for run in self.runs]
+        if self.sort:
+            self.names.sort()
+            return heapq.merge(*(runs + [iter(self.names)]))
+        return chain(*(runs + [iter(self.names)]))
+
+
+def iterdir(path, pool=None):
+    """Yield ``(name, isdir)`` for each entry in the directory ``path``,
+    without building a list of all entries first if ``scandir`` is
+    available. Otherwise each entry is stat()ed, in the threads of ``pool``
+    if one is given.
+    """
+    if scandir is None:
+        paths = (os.path.join(path, name) for name in os.listdir(path))
+        if pool is None:
+            stats = ((entryPath, os.path.isdir(entryPath))
+                     for entryPath in paths)
+        else:
+            stats = pool.imap(os.path.isdir, paths)
+        for entryPath, isdir in stats:
+            yield os.path.basename(entryPath), isdir
+    else:
+        for entry in scandir(path):
+            yield entry.name, entry.is_dir()
+
+
+def scandirectory(path, sort=True, size=100000, pool=None):
+    """Return the names of the subdirectories and files in the directory
+    ``path`` as two spools, so that memory use stays bounded however many
+    entries it has, or None if the directory cannot be read.
+    """
+    dirnames = Spool(sort, size)
+    filenames = Spool(sort, size)
+    try:
+        for name, isdir in iterdir(path, pool):
+            if isdir:
+                dirnames.append(name)
+            else:
+                filenames.append(name)
+    except OSError:
+        return None
+    return dirnames, filenames
+
+
+def unique(names):
+    """Drop repeated names from the sorted iterable ``names``.
+    """
+    lastName = None
+    for name in names:
+        if name != lastName:
+            yield name
+        lastName = name